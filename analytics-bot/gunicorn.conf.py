@@ -0,0 +1,24 @@
+"""
+Gunicorn configuration for the analytics bot.
+
+The app is preloaded so init_db() (table and index creation) runs once in
+the master before workers fork. Background threads don't survive fork(),
+so each worker starts its own scheduler in post_fork.
+
+Workers are threaded (gthread): each one serves several webhook requests
+concurrently, while slow Telegram/QR calls already run on background pools.
+"""
+
+import os
+
+preload_app = True
+
+worker_class = 'gthread'
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+
+
+def post_fork(server, worker):
+    """Start the event flush / report scheduler in each worker."""
+    import server as analytics_server
+    analytics_server.start_scheduler()
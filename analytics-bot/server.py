@@ -10,56 +10,236 @@ Sends hourly reports to Telegram with conversion funnel metrics.
 """
 
 import os
-import json
+import re
+import atexit
+import collections
+import logging
+import queue
+import time
 import sqlite3
 import hashlib
 import hmac
+import threading
 from datetime import datetime, timedelta
 from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from zoneinfo import ZoneInfo
+from logging.handlers import QueueHandler, QueueListener
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+import orjson
 import stripe
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
-import pytz
 
 # Load environment variables
 load_dotenv()
 
+# Logging: request threads only enqueue records; formatting and writing to
+# stderr happen on the listener thread
+log = logging.getLogger(__name__)
+log.setLevel(logging.INFO)
+log.propagate = False
+_log_queue = queue.SimpleQueue()
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s %(message)s'))
+_log_listener = None
+
+
+def _start_log_listener():
+    """Start a listener thread; a fresh one each time since threads don't survive fork()."""
+    global _log_listener
+    _log_listener = QueueListener(_log_queue, _log_stream)
+    _log_listener.start()
+
+
+def _stop_log_listener():
+    """Write out any queued records and stop the listener thread."""
+    if _log_listener is not None:
+        _log_listener.stop()
+
+
+if not log.handlers:
+    log.addHandler(QueueHandler(_log_queue))
+    _start_log_listener()
+    atexit.register(_stop_log_listener)
+    # Workers forked from a preloaded app need their own listener thread
+    os.register_at_fork(after_in_child=_start_log_listener)
+
 app = Flask(__name__)
 
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 # Support multiple chat IDs (comma separated)
 chat_ids_str = os.getenv('TELEGRAM_CHAT_ID', '')
 TELEGRAM_CHAT_IDS = [cid.strip() for cid in chat_ids_str.split(',') if cid.strip()]
+TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
 STRIPE_WEBHOOK_SECRET = os.getenv('STRIPE_WEBHOOK_SECRET')
 QR_API_KEY = os.getenv('QR_API_KEY')
 QR_CODE_ID = os.getenv('QR_CODE_ID', '88145711')  # Your QR code ID
-TIMEZONE = pytz.timezone(os.getenv('TIMEZONE', 'America/New_York'))
+QR_CACHE_TTL_SECONDS = 300
+TIMEZONE = ZoneInfo(os.getenv('TIMEZONE', 'America/New_York'))
 DATABASE = 'analytics.db'
 
+# Per-connection tuning applied every time a connection is opened
+SQLITE_PRAGMAS = (
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA busy_timeout=5000',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-20000',
+)
+
+# Buffered event writes are flushed on this interval, or sooner once
+# EVENT_FLUSH_BATCH_SIZE events are waiting
+EVENT_FLUSH_INTERVAL_SECONDS = 0.5
+EVENT_FLUSH_BATCH_SIZE = 200
+# Upper bound on buffered events while the database is unwritable; the
+# oldest are dropped (and logged) past this
+EVENT_QUEUE_MAX_SIZE = 10000
+
+# Events older than this are moved to events_archive by the nightly job
+EVENT_RETENTION_DAYS = 30
+# QR snapshots older than this are deleted nightly
+QR_SNAPSHOT_RETENTION_DAYS = 7
+
 # Initialize Stripe
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY', '')
+STRIPE_SECRET_BYTES = (STRIPE_WEBHOOK_SECRET or '').encode()
+STRIPE_SIGNATURE_TOLERANCE_SECONDS = 300
+
+# Shared keep-alive session for Telegram and the QR Code Generator API, so
+# repeated calls reuse TLS connections. pool_connections is the number of
+# hosts kept; pool_maxsize is the connections kept per host
+_http_session = requests.Session()
+_http_session.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=16,
+    max_retries=Retry(total=2, backoff_factor=0.2)
+))
+
+# Webhook follow-up work that ends in a Telegram send (Stripe event
+# processing, notifications) runs here so responses don't wait on it.
+# Workers can sit on a Telegram round trip, so nothing else goes here
+_notify_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='notify')
+
+# Event flushes and cache refreshes get their own workers so they never wait
+# behind Telegram sends on _notify_pool
+_maintenance_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='maintenance')
+
+# Matches the event types stripe_webhook() handles, so everything else can be
+# acknowledged without decoding the JSON body
+STRIPE_HANDLED_EVENT_RE = re.compile(
+    rb'"type"\s*:\s*"checkout\.session\.(?:completed|expired)"'
+)
+
+# Endpoints called cross-origin from the website; see add_cors_headers()
+CORS_PATHS = ('/track/click', '/signup')
+CORS_PREFLIGHT_HEADERS = {
+    'Access-Control-Allow-Methods': 'POST, OPTIONS',
+    'Access-Control-Allow-Headers': 'Content-Type',
+}
+
+# /emails page sizes
+EMAILS_PAGE_SIZE = 500
+EMAILS_MAX_PAGE_SIZE = 5000
+
+# Basic email shape check: something@domain.tld, no whitespace
+EMAIL_RE = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
 
 
 # ============================================================================
 # Database Setup
 # ============================================================================
 
+# Hot-path statements, kept in one place. sqlite3 caches prepared
+# statements per connection by SQL text, so these compile once per thread
+SQL_INSERT_EVENT = (
+    'INSERT INTO events (event_type, data, amount_cents, ts_epoch, timestamp) '
+    "VALUES (?1, ?2, ?3, ?4, datetime(?4, 'unixepoch'))"
+)
+SQL_INSERT_SIGNUP = (
+    'INSERT INTO email_signups (email, source) VALUES (?, ?) '
+    'ON CONFLICT (email) DO NOTHING RETURNING id'
+)
+SQL_COUNT_SIGNUPS = 'SELECT COUNT(*) FROM email_signups'
+# Latest QR snapshot totals at or before each of two points in time, plus
+# the most recent snapshot overall
+SQL_QR_BASELINES = '''
+    SELECT
+        (SELECT total_scans FROM qr_snapshots WHERE timestamp <= ?
+         ORDER BY timestamp DESC LIMIT 1),
+        (SELECT total_scans FROM qr_snapshots WHERE timestamp <= ?
+         ORDER BY timestamp DESC LIMIT 1),
+        (SELECT total_scans FROM qr_snapshots ORDER BY id DESC LIMIT 1)
+'''
+# Hourly and daily counters in one pass over the rows since the earlier
+# bound; all bounds are unix seconds compared against ts_epoch. COALESCE
+# keeps each counter an integer when no rows fall in the window
+SQL_STATS = '''
+    SELECT
+        COALESCE(SUM(CASE WHEN event_type = 'qr_scan'  AND ts_epoch > :cutoff THEN 1 ELSE 0 END), 0) AS hr_scan,
+        COALESCE(SUM(CASE WHEN event_type = 'click'    AND ts_epoch > :cutoff THEN 1 ELSE 0 END), 0) AS hr_click,
+        COALESCE(SUM(CASE WHEN event_type = 'purchase' AND ts_epoch > :cutoff THEN 1 ELSE 0 END), 0) AS hr_purchase,
+        COALESCE(SUM(CASE WHEN event_type = 'expired'  AND ts_epoch > :cutoff THEN 1 ELSE 0 END), 0) AS hr_expired,
+        COALESCE(SUM(CASE WHEN event_type = 'purchase' AND ts_epoch > :cutoff THEN amount_cents ELSE 0 END), 0) AS hr_cents,
+        COALESCE(SUM(CASE WHEN event_type = 'qr_scan'  AND ts_epoch > :today  THEN 1 ELSE 0 END), 0) AS td_scan,
+        COALESCE(SUM(CASE WHEN event_type = 'click'    AND ts_epoch > :today  THEN 1 ELSE 0 END), 0) AS td_click,
+        COALESCE(SUM(CASE WHEN event_type = 'purchase' AND ts_epoch > :today  THEN 1 ELSE 0 END), 0) AS td_purchase,
+        COALESCE(SUM(CASE WHEN event_type = 'expired'  AND ts_epoch > :today  THEN 1 ELSE 0 END), 0) AS td_expired,
+        COALESCE(SUM(CASE WHEN event_type = 'purchase' AND ts_epoch > :today  THEN amount_cents ELSE 0 END), 0) AS td_cents
+    FROM events
+    WHERE ts_epoch > :since
+'''
+
+
 def init_db():
     """Initialize the SQLite database with required tables."""
     with get_db() as conn:
+        # WAL is persistent in the database file, so it only needs setting once
+        conn.execute('PRAGMA journal_mode=WAL')
         conn.execute('''
             CREATE TABLE IF NOT EXISTS events (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 event_type TEXT NOT NULL,
                 timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
                 data TEXT,
-                amount_cents INTEGER DEFAULT 0
+                amount_cents INTEGER DEFAULT 0,
+                ts_epoch INTEGER
             )
         ''')
+        # Old events are moved here nightly to keep the events table small
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS events_archive (
+                id INTEGER PRIMARY KEY,
+                event_type TEXT NOT NULL,
+                timestamp DATETIME,
+                data TEXT,
+                amount_cents INTEGER DEFAULT 0,
+                ts_epoch INTEGER
+            )
+        ''')
+        # Databases created before ts_epoch existed: add it and backfill from
+        # the text timestamp (stored in UTC)
+        conn.execute('BEGIN IMMEDIATE')
+        for table in ('events', 'events_archive'):
+            columns = {column[1] for column in conn.execute(f'PRAGMA table_info({table})')}
+            if 'ts_epoch' not in columns:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN ts_epoch INTEGER')
+                conn.execute(
+                    f"UPDATE {table} SET ts_epoch = CAST(strftime('%s', timestamp) AS INTEGER)"
+                )
+        conn.execute('COMMIT')
+        # Covering index for get_stats(): seeks straight to the time window and
+        # reads event_type/amount_cents without touching the table. Integer
+        # keys are smaller and compare faster than the old text timestamps
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_events_epoch_type
+            ON events (ts_epoch, event_type, amount_cents)
+        ''')
         # Table to store QR scan count snapshots for calculating hourly changes
         conn.execute('''
             CREATE TABLE IF NOT EXISTS qr_snapshots (
@@ -69,6 +249,11 @@ def init_db():
                 unique_scans INTEGER
             )
         ''')
+        # get_qr_scan_count() looks up the latest snapshot before a point in time
+        conn.execute('''
+            CREATE INDEX IF NOT EXISTS idx_qr_snapshots_ts
+            ON qr_snapshots (timestamp DESC)
+        ''')
         # Table to store email signups for launch notification
         conn.execute('''
             CREATE TABLE IF NOT EXISTS email_signups (
@@ -78,39 +263,215 @@ def init_db():
                 source TEXT DEFAULT 'website'
             )
         ''')
-        conn.commit()
+        # Gather planner statistics once there is data, so the indexes above
+        # get picked; the nightly archive job keeps them current with
+        # PRAGMA optimize
+        try:
+            has_stats = conn.execute('SELECT 1 FROM sqlite_stat1 LIMIT 1').fetchone()
+        except sqlite3.OperationalError:
+            has_stats = None  # ANALYZE has never run
+        if not has_stats:
+            conn.execute('ANALYZE')
+
+
+_local = threading.local()
+
+
+def _connect():
+    """Open a tuned, autocommit connection to the analytics database."""
+    conn = sqlite3.connect(DATABASE, check_same_thread=False, isolation_level=None)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
 
 
 @contextmanager
 def get_db():
-    """Context manager for database connections."""
-    conn = sqlite3.connect(DATABASE)
-    conn.row_factory = sqlite3.Row
+    """
+    Context manager for database connections.
+
+    Each thread keeps one long-lived connection instead of reconnecting per
+    call. The owning PID is tracked so a forked worker never reuses a
+    connection inherited from its parent.
+    """
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        _local.conn = _connect()
+        _local.pid = pid
+    yield _local.conn
+
+
+_event_queue = collections.deque()
+_queue_lock = threading.Lock()
+# Held while a flush runs so only one is ever in flight
+_flush_lock = threading.Lock()
+# Set while a flush woken by log_event() is waiting to run
+_flush_requested = False
+
+
+def log_event(event_type: str, data: dict = None, amount_cents: int = 0):
+    """
+    Queue an event for the database.
+
+    Rows are written in batches by _flush_events() so webhook requests never
+    wait on a commit. The timestamp is captured here so it reflects when the
+    event arrived.
+    """
+    row = (
+        event_type,
+        orjson.dumps(data).decode() if data else None,
+        amount_cents,
+        int(time.time()),
+    )
+    global _flush_requested
+    with _queue_lock:
+        # Past the cap (database unwritable for a while) the oldest event goes
+        dropped = len(_event_queue) >= EVENT_QUEUE_MAX_SIZE
+        if dropped:
+            _event_queue.popleft()
+        _event_queue.append(row)
+        # A full batch wakes one background flush; the request never writes
+        wake_flush = len(_event_queue) >= EVENT_FLUSH_BATCH_SIZE and not _flush_requested
+        if wake_flush:
+            _flush_requested = True
+    log.info("Logged event: %s", event_type)
+    if dropped:
+        log.error("Event queue full: dropped oldest event")
+
+    if wake_flush:
+        try:
+            _maintenance_pool.submit(_flush_full_batch)
+        except RuntimeError:
+            # Pool is shutting down; the atexit flush picks these up
+            pass
+
+
+def _flush_full_batch():
+    """Flush woken by log_event() (runs on _maintenance_pool)."""
+    global _flush_requested
+    with _queue_lock:
+        _flush_requested = False
+    _flush_events()
+
+
+def _flush_events(wait: bool = False):
+    """
+    Write all queued events to the database in a single transaction.
+    Returns straight away if another flush is running, unless wait is set.
+    """
+    if not _flush_lock.acquire(blocking=wait):
+        return
     try:
-        yield conn
+        _write_queued_events()
     finally:
-        conn.close()
+        _flush_lock.release()
 
 
-def log_event(event_type: str, data: dict = None, amount_cents: int = 0):
-    """Log an event to the database."""
+def _write_queued_events():
+    """Insert the queued events, requeueing them if the write fails."""
+    global _event_queue
+    with _queue_lock:
+        if not _event_queue:
+            return
+        batch, _event_queue = _event_queue, collections.deque()
+
+    conn = None
+    try:
+        # Inside the try so a failed connect requeues the batch too
+        with get_db() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany(SQL_INSERT_EVENT, batch)
+            conn.execute('COMMIT')
+    except Exception as e:
+        if conn is not None and conn.in_transaction:
+            conn.execute('ROLLBACK')
+        log.error("Event flush error (%d events requeued): %s", len(batch), e)
+        # Put the batch back in front of anything queued meanwhile,
+        # dropping the oldest events if the queue is over its cap
+        with _queue_lock:
+            _event_queue.extendleft(reversed(batch))
+            overflow = len(_event_queue) - EVENT_QUEUE_MAX_SIZE
+            for _ in range(overflow):
+                _event_queue.popleft()
+        if overflow > 0:
+            log.error("Event queue full: dropped %d oldest events", overflow)
+
+
+# Drain anything still buffered when the process exits
+atexit.register(_flush_events, wait=True)
+
+
+def _archive_events():
+    """Move events past the retention window into events_archive."""
+    cutoff = int(time.time()) - EVENT_RETENTION_DAYS * 86400
     with get_db() as conn:
-        conn.execute(
-            'INSERT INTO events (event_type, data, amount_cents) VALUES (?, ?, ?)',
-            (event_type, json.dumps(data) if data else None, amount_cents)
-        )
-        conn.commit()
-    print(f"[{datetime.now()}] Logged event: {event_type}")
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('''
+                INSERT INTO events_archive (id, event_type, timestamp, data, amount_cents, ts_epoch)
+                SELECT id, event_type, timestamp, data, amount_cents, ts_epoch
+                FROM events WHERE ts_epoch < ?
+            ''', (cutoff,))
+            archived = conn.execute(
+                'DELETE FROM events WHERE ts_epoch < ?', (cutoff,)
+            ).rowcount
+            conn.execute('COMMIT')
+        except Exception as e:
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            log.error("Event archive error: %s", e)
+            return
+        # Refresh planner statistics now that the table has shrunk
+        conn.execute('PRAGMA optimize')
+    log.info("Archived %d events older than %d days", archived, EVENT_RETENTION_DAYS)
+
+
+def _prune_qr_snapshots():
+    """
+    Delete QR snapshots past the retention window. The newest snapshot
+    before the cutoff is kept, since it is still the baseline for any point
+    in time up to the next snapshot.
+    """
+    with get_db() as conn:
+        pruned = conn.execute('''
+            DELETE FROM qr_snapshots
+            WHERE timestamp < datetime('now', ?1)
+              AND id < (SELECT MAX(id) FROM qr_snapshots WHERE timestamp < datetime('now', ?1))
+        ''', (f'-{QR_SNAPSHOT_RETENTION_DAYS} days',)).rowcount
+    log.info("Pruned %d QR snapshots older than %d days", pruned, QR_SNAPSHOT_RETENTION_DAYS)
 
 
 # ============================================================================
 # Webhook Endpoints
 # ============================================================================
 
+def json_response(obj, status: int = 200) -> Response:
+    """Build a JSON response with orjson, skipping Flask's slower encoder."""
+    return Response(orjson.dumps(obj), status=status, mimetype='application/json')
+
+
+@app.after_request
+def add_cors_headers(response):
+    """Let the website call the click tracking and signup endpoints."""
+    if request.path in CORS_PATHS:
+        response.headers['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+# Serialized /health body, rebuilt at most once per second
+_health_cache = {'body': b'', 'expires': 0.0}
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint for Railway."""
-    return jsonify({'status': 'healthy', 'timestamp': datetime.now().isoformat()})
+    now = time.monotonic()
+    if now >= _health_cache['expires']:
+        _health_cache['body'] = orjson.dumps(
+            {'status': 'healthy', 'timestamp': datetime.now().isoformat()}
+        )
+        _health_cache['expires'] = now + 1
+    return Response(_health_cache['body'], mimetype='application/json')
 
 
 @app.route('/webhook/qr', methods=['POST'])
@@ -125,45 +486,43 @@ def qr_webhook():
     - short URL / QR code ID
     """
     try:
-        data = request.get_json() or request.form.to_dict()
+        if request.content_type and 'json' in request.content_type:
+            data = orjson.loads(request.data) or {}
+        else:
+            data = request.form.to_dict()
         
         # Log the scan event
         log_event('qr_scan', {
             'country': data.get('country'),
             'device': data.get('device_type'),
-            'qr_id': data.get('short_url') or data.get('qr_code_id'),
-            'raw': data
+            'qr_id': data.get('short_url') or data.get('qr_code_id')
         })
         
-        return jsonify({'success': True}), 200
+        return json_response({'success': True})
     except Exception as e:
-        print(f"QR webhook error: {e}")
-        return jsonify({'error': str(e)}), 500
+        log.error("QR webhook error: %s", e)
+        return json_response({'error': str(e)}, 500)
+
 
+@app.route('/track/click', methods=['OPTIONS'])
+@app.route('/signup', methods=['OPTIONS'])
+def cors_preflight():
+    """Answer CORS preflight requests for the website endpoints."""
+    return '', 204, CORS_PREFLIGHT_HEADERS
 
-@app.route('/track/click', methods=['POST', 'OPTIONS'])
+
+@app.route('/track/click', methods=['POST'], provide_automatic_options=False)
 def track_click():
     """
     Receive click tracking events from the website.
     Uses sendBeacon, so we need to handle both JSON and form data.
     """
-    # Handle CORS preflight
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        return response, 200
-    
     try:
-        # sendBeacon may send as text/plain
-        if request.content_type and 'json' in request.content_type:
-            data = request.get_json()
-        else:
-            try:
-                data = json.loads(request.data.decode('utf-8'))
-            except:
-                data = {}
+        # sendBeacon may send as text/plain, so always parse the raw body
+        try:
+            data = orjson.loads(request.data)
+        except orjson.JSONDecodeError:
+            data = {}
         
         log_event('click', {
             'button': data.get('button'),
@@ -171,63 +530,42 @@ def track_click():
             'page': data.get('page', 'unknown')
         })
         
-        response = jsonify({'success': True})
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        return response, 200
+        return json_response({'success': True})
     except Exception as e:
-        print(f"Click tracking error: {e}")
-        return jsonify({'error': str(e)}), 500
+        log.error("Click tracking error: %s", e)
+        return json_response({'error': str(e)}, 500)
 
 
-@app.route('/signup', methods=['POST', 'OPTIONS'])
+@app.route('/signup', methods=['POST'], provide_automatic_options=False)
 def email_signup():
     """
     Receive email signups for launch notification.
     Stores in SQLite and optionally sends to Google Sheets.
     """
-    # Handle CORS preflight
-    if request.method == 'OPTIONS':
-        response = jsonify({'status': 'ok'})
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        response.headers['Access-Control-Allow-Methods'] = 'POST, OPTIONS'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
-        return response, 200
-    
     try:
         # Parse request data
-        if request.content_type and 'json' in request.content_type:
-            data = request.get_json()
-        else:
-            try:
-                data = json.loads(request.data.decode('utf-8'))
-            except:
-                data = {}
+        try:
+            data = orjson.loads(request.data)
+        except orjson.JSONDecodeError:
+            data = {}
         
         email = data.get('email', '').strip().lower()
         
         # Basic email validation
-        if not email or '@' not in email or '.' not in email:
-            response = jsonify({'success': False, 'error': 'Invalid email address'})
-            response.headers['Access-Control-Allow-Origin'] = '*'
-            return response, 400
+        if not EMAIL_RE.match(email):
+            return json_response({'success': False, 'error': 'Invalid email address'}, 400)
         
-        # Store in database
+        # Store in database; RETURNING yields no row when the email exists
         with get_db() as conn:
-            try:
-                conn.execute(
-                    'INSERT INTO email_signups (email, source) VALUES (?, ?)',
-                    (email, data.get('source', 'website'))
-                )
-                conn.commit()
-                
-                # Get total signup count
-                count = conn.execute('SELECT COUNT(*) FROM email_signups').fetchone()[0]
-                
-            except sqlite3.IntegrityError:
-                # Email already exists
-                response = jsonify({'success': True, 'message': 'Already signed up!'})
-                response.headers['Access-Control-Allow-Origin'] = '*'
-                return response, 200
+            inserted = conn.execute(
+                SQL_INSERT_SIGNUP, (email, data.get('source', 'website'))
+            ).fetchall()
+            
+            if not inserted:
+                return json_response({'success': True, 'message': 'Already signed up!'})
+            
+            # Get total signup count
+            count = conn.execute(SQL_COUNT_SIGNUPS).fetchone()[0]
         
         # Send Telegram notification
         send_signup_notification(email, count)
@@ -235,15 +573,43 @@ def email_signup():
         # Log as event too
         log_event('email_signup', {'email': email})
         
-        response = jsonify({'success': True, 'message': 'Thanks! We\'ll notify you at launch.'})
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        return response, 200
+        return json_response({'success': True, 'message': 'Thanks! We\'ll notify you at launch.'})
         
     except Exception as e:
-        print(f"Email signup error: {e}")
-        response = jsonify({'success': False, 'error': 'Something went wrong'})
-        response.headers['Access-Control-Allow-Origin'] = '*'
-        return response, 500
+        log.error("Email signup error: %s", e)
+        return json_response({'success': False, 'error': 'Something went wrong'}, 500)
+
+
+def verify_stripe_signature(payload: bytes, sig_header: str) -> bool:
+    """
+    Check a Stripe-Signature header against the raw request body.
+    
+    Same scheme as stripe.WebhookSignature.verify_header(): an HMAC-SHA256
+    of "{t}.{body}" must match one of the v1 signatures, and t must be
+    within the tolerance. Works on the raw bytes, so nothing is decoded.
+    """
+    timestamp = None
+    signatures = []
+    for item in (sig_header or '').split(','):
+        key, _, value = item.strip().partition('=')
+        if key == 't':
+            timestamp = value
+        elif key == 'v1':
+            signatures.append(value)
+    
+    if not timestamp or not timestamp.isdigit() or not signatures:
+        return False
+    if int(timestamp) < time.time() - STRIPE_SIGNATURE_TOLERANCE_SECONDS:
+        return False
+    
+    expected = hmac.new(
+        STRIPE_SECRET_BYTES, timestamp.encode() + b'.' + payload, hashlib.sha256
+    ).hexdigest().encode()
+    # Compare bytes: compare_digest rejects non-ASCII str with a TypeError
+    return any(
+        hmac.compare_digest(expected, signature.encode('utf-8', 'surrogateescape'))
+        for signature in signatures
+    )
 
 
 @app.route('/webhook/stripe', methods=['POST'])
@@ -253,19 +619,35 @@ def stripe_webhook():
     
     We're interested in:
     - checkout.session.completed (successful payment)
+    - checkout.session.expired (abandoned checkout)
     """
     payload = request.data
     sig_header = request.headers.get('Stripe-Signature')
     
     try:
-        # Verify webhook signature
-        if STRIPE_WEBHOOK_SECRET:
-            event = stripe.Webhook.construct_event(
-                payload, sig_header, STRIPE_WEBHOOK_SECRET
-            )
-        else:
-            # Dev mode - no signature verification
-            event = json.loads(payload)
+        # Verify webhook signature (HMAC over the raw body, no JSON parsing)
+        # Dev mode (no secret configured) skips verification
+        if STRIPE_WEBHOOK_SECRET and not verify_stripe_signature(payload, sig_header):
+            log.warning("Stripe signature verification failed")
+            return json_response({'error': 'Invalid signature'}, 400)
+        
+        # Acknowledge event types we don't track without decoding them
+        if not STRIPE_HANDLED_EVENT_RE.search(payload):
+            return json_response({'received': True})
+        
+        # Parse, log and notify after Stripe has its 200
+        _notify_pool.submit(_process_stripe_event, payload)
+        
+        return json_response({'received': True})
+    except Exception as e:
+        log.error("Stripe webhook error: %s", e)
+        return json_response({'error': str(e)}, 500)
+
+
+def _process_stripe_event(payload: bytes):
+    """Log a checkout event and send its notification (runs on _notify_pool)."""
+    try:
+        event = orjson.loads(payload)
         
         # Handle successful checkout
         if event['type'] == 'checkout.session.completed':
@@ -289,44 +671,48 @@ def stripe_webhook():
                 'session_id': session.get('id'),
                 'amount': session.get('amount_total', 0) / 100
             })
-        
-        return jsonify({'received': True}), 200
-    except stripe.error.SignatureVerificationError as e:
-        print(f"Stripe signature verification failed: {e}")
-        return jsonify({'error': 'Invalid signature'}), 400
     except Exception as e:
-        print(f"Stripe webhook error: {e}")
-        return jsonify({'error': str(e)}), 500
+        log.error("Stripe event processing error: %s", e)
 
 
 # ============================================================================
 # Telegram Notifications
 # ============================================================================
 
+# Per-chat sends fan out here so a message costs one round trip regardless
+# of how many chats are configured. Kept separate from _notify_pool so a queued
+# notification never waits on its own fan-out
+_tg_send_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='telegram-send')
+
+# Bodies are pre-encoded with orjson rather than passed via requests' json=
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
 def send_telegram_message(text: str):
     """Send a message to all configured Telegram chats."""
     if not TELEGRAM_BOT_TOKEN or not TELEGRAM_CHAT_IDS:
-        print(f"Telegram not configured. Message: {text}")
+        log.info("Telegram not configured. Message: %s", text)
         return False
     
-    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-    success = True
-    
-    for chat_id in TELEGRAM_CHAT_IDS:
-        payload = {
+    def send_to_chat(chat_id):
+        body = orjson.dumps({
             'chat_id': chat_id,
             'text': text,
             'parse_mode': 'HTML'
-        }
+        })
         
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = _http_session.post(
+                TELEGRAM_API_URL, data=body, headers=JSON_HEADERS, timeout=10
+            )
             response.raise_for_status()
+            return True
         except Exception as e:
-            print(f"Telegram error for chat {chat_id}: {e}")
-            success = False
-            
-    return success
+            log.error("Telegram error for chat %s: %s", chat_id, e)
+            return False
+    
+    results = list(_tg_send_pool.map(send_to_chat, TELEGRAM_CHAT_IDS))
+    return all(results)
 
 
 def send_purchase_notification(session: dict):
@@ -352,128 +738,197 @@ def send_signup_notification(email: str, total_count: int):
         f"📊 Total signups: {total_count}\n"
         f"🕐 Time: {datetime.now(TIMEZONE).strftime('%I:%M %p')}"
     )
-    send_telegram_message(message)
+    _notify_pool.submit(send_telegram_message, message)
 
 
 def get_stats(hours: int = 1) -> dict:
     """Get event statistics for the specified time period."""
-    now = datetime.utcnow()
-    cutoff = now - timedelta(hours=hours)
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    now = int(time.time())
+    cutoff = now - hours * 3600
+    today_start = now - now % 86400  # Midnight UTC
     
+    # Make sure buffered events are counted
+    _flush_events(wait=True)
+
     with get_db() as conn:
-        # Last N hours
-        hour_stats = conn.execute('''
-            SELECT 
-                event_type,
-                COUNT(*) as count,
-                SUM(amount_cents) as total_cents
-            FROM events
-            WHERE timestamp > ?
-            GROUP BY event_type
-        ''', (cutoff.isoformat(),)).fetchall()
-        
-        # Today totals
-        today_stats = conn.execute('''
-            SELECT 
-                event_type,
-                COUNT(*) as count,
-                SUM(amount_cents) as total_cents
-            FROM events
-            WHERE timestamp > ?
-            GROUP BY event_type
-        ''', (today_start.isoformat(),)).fetchall()
-    
-    def dict_from_stats(stats):
-        result = {'qr_scan': 0, 'click': 0, 'purchase': 0, 'expired': 0, 'revenue': 0}
-        for row in stats:
-            result[row['event_type']] = row['count']
-            if row['event_type'] == 'purchase':
-                result['revenue'] = (row['total_cents'] or 0) / 100
-        return result
+        row = conn.execute(SQL_STATS, {
+            'cutoff': cutoff,
+            'today': today_start,
+            'since': min(cutoff, today_start),
+        }).fetchone()
+    
+    (hr_scan, hr_click, hr_purchase, hr_expired, hr_cents,
+     td_scan, td_click, td_purchase, td_expired, td_cents) = row
     
     return {
-        'hour': dict_from_stats(hour_stats),
-        'today': dict_from_stats(today_stats)
+        'hour': {
+            'qr_scan': hr_scan,
+            'click': hr_click,
+            'purchase': hr_purchase,
+            'expired': hr_expired,
+            'revenue': hr_cents / 100
+        },
+        'today': {
+            'qr_scan': td_scan,
+            'click': td_click,
+            'purchase': td_purchase,
+            'expired': td_expired,
+            'revenue': td_cents / 100
+        }
     }
 
 
-def get_qr_scan_count() -> dict:
+QR_EMPTY_COUNTS = {'total': 0, 'unique': 0, 'last_hour': 0, 'today': 0}
+
+# Cached QR counts; refreshed at most once per QR_CACHE_TTL_SECONDS
+_qr_cache = {'value': None, 'expires': 0.0}
+_qr_refresh_lock = threading.Lock()
+
+
+def get_qr_scan_count(allow_stale: bool = True) -> dict:
     """
-    Fetch QR code scan counts from QR Code Generator API.
-    Calculates hourly scans by comparing to the last stored snapshot.
+    Get QR code scan counts, cached for QR_CACHE_TTL_SECONDS.
+    Once the cache expires the stale counts are still returned while a
+    refresh runs in the background; only the first call waits on the API.
+    With allow_stale=False an expired cache is refreshed before returning.
     Returns total, unique, and hourly scan counts.
     """
     if not QR_API_KEY or not QR_CODE_ID:
-        return {'total': 0, 'unique': 0, 'last_hour': 0, 'today': 0}
+        return QR_EMPTY_COUNTS
     
+    cached = _qr_cache['value']
+    if cached is None or (not allow_stale and time.monotonic() >= _qr_cache['expires']):
+        # Waits for any background refresh already in progress
+        with _qr_refresh_lock:
+            if time.monotonic() >= _qr_cache['expires']:
+                _refresh_qr_scan_count()
+        return _qr_cache['value'] or QR_EMPTY_COUNTS
+    
+    if time.monotonic() >= _qr_cache['expires'] and not _qr_refresh_lock.locked():
+        try:
+            _maintenance_pool.submit(_refresh_qr_scan_count_in_background)
+        except RuntimeError:
+            # Pool is shutting down
+            pass
+    return cached
+
+
+def _refresh_qr_scan_count_in_background():
+    """Refresh an expired QR cache unless a refresh is already running."""
+    if not _qr_refresh_lock.acquire(blocking=False):
+        return
+    try:
+        if time.monotonic() >= _qr_cache['expires']:
+            _refresh_qr_scan_count()
+    finally:
+        _qr_refresh_lock.release()
+
+
+def _refresh_qr_scan_count():
+    """Fetch fresh QR counts into the cache, keeping the old value on error."""
+    try:
+        counts = _fetch_qr_scan_count()
+    except Exception as e:
+        log.error("QR API error: %s", e)
+        return
+    _qr_cache['value'] = counts
+    _qr_cache['expires'] = time.monotonic() + QR_CACHE_TTL_SECONDS
+
+
+def _fetch_qr_scan_count() -> dict:
+    """
+    Fetch QR code scan counts from QR Code Generator API.
+    Calculates hourly scans by comparing to the last stored snapshot,
+    then stores a new snapshot if the total changed.
+    """
     url = f"https://api.qr-code-generator.com/v1/qr-codes/{QR_CODE_ID}/scans/total"
     headers = {
         'Authorization': f'Key {QR_API_KEY}'
     }
     
-    try:
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        current_total = data.get('total', 0)
-        current_unique = data.get('unique', 0)
+    response = _http_session.get(url, headers=headers, timeout=10)
+    response.raise_for_status()
+    data = response.json()
+    current_total = data.get('total', 0)
+    current_unique = data.get('unique', 0)
+    
+    # Snapshots from ~1 hour ago and from the start of today (UTC), in
+    # the 'YYYY-MM-DD HH:MM:SS' format the timestamp column stores
+    now = datetime.utcnow()
+    hour_ago = (now - timedelta(hours=1)).isoformat(sep=' ', timespec='seconds')
+    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0).isoformat(sep=' ', timespec='seconds')
+    
+    with get_db() as conn:
+        hour_total, today_total, latest_total = conn.execute(
+            SQL_QR_BASELINES, (hour_ago, today_start)
+        ).fetchone()
         
-        # Get the last snapshot to calculate hourly scans
-        with get_db() as conn:
-            # Get snapshot from ~1 hour ago
-            hour_ago = (datetime.utcnow() - timedelta(hours=1)).isoformat()
-            hour_snapshot = conn.execute('''
-                SELECT total_scans FROM qr_snapshots 
-                WHERE timestamp <= ? 
-                ORDER BY timestamp DESC LIMIT 1
-            ''', (hour_ago,)).fetchone()
-            
-            # Get snapshot from start of today (UTC)
-            today_start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0).isoformat()
-            today_snapshot = conn.execute('''
-                SELECT total_scans FROM qr_snapshots 
-                WHERE timestamp <= ? 
-                ORDER BY timestamp DESC LIMIT 1
-            ''', (today_start,)).fetchone()
-            
-            # Store current snapshot
+        # Store current snapshot, only when the count moved. The latest
+        # snapshot at or before any point then still holds the total as of
+        # that point, so the baselines above are unaffected
+        if current_total != latest_total:
             conn.execute(
                 'INSERT INTO qr_snapshots (total_scans, unique_scans) VALUES (?, ?)',
                 (current_total, current_unique)
             )
-            conn.commit()
-        
-        # Calculate differences
-        last_hour_scans = current_total - (hour_snapshot['total_scans'] if hour_snapshot else current_total)
-        today_scans = current_total - (today_snapshot['total_scans'] if today_snapshot else current_total)
-        
-        # Ensure non-negative (in case of data issues)
-        last_hour_scans = max(0, last_hour_scans)
-        today_scans = max(0, today_scans)
-        
-        return {
-            'total': current_total,
-            'unique': current_unique,
-            'last_hour': last_hour_scans,
-            'today': today_scans
-        }
-    except Exception as e:
-        print(f"QR API error: {e}")
-        return {'total': 0, 'unique': 0, 'last_hour': 0, 'today': 0}
+    
+    # Calculate differences
+    last_hour_scans = current_total - (hour_total if hour_total is not None else current_total)
+    today_scans = current_total - (today_total if today_total is not None else current_total)
+    
+    # Ensure non-negative (in case of data issues)
+    last_hour_scans = max(0, last_hour_scans)
+    today_scans = max(0, today_scans)
+    
+    return {
+        'total': current_total,
+        'unique': current_unique,
+        'last_hour': last_hour_scans,
+        'today': today_scans
+    }
+
+
+REPORT_DIVIDER = '━' * 27
+
+# Static report text, built once; send_hourly_report() fills it with format_map()
+HOURLY_REPORT_TEMPLATE = (
+    "📊 <b>Delivery Hatch — Hourly Report</b>\n"
+    f"{REPORT_DIVIDER}\n\n"
+    
+    "🔲 <b>QR Code Scans</b>\n"
+    "   • Last hour: {qr_last_hour}\n"
+    "   • Today: {qr_today}\n"
+    "   • All-time: {qr_total} ({qr_unique} unique)\n\n"
+    
+    "🖱️ <b>Pre-order Clicks</b>\n"
+    "   • Last hour: {hr_click}\n"
+    "   • Today: {td_click}\n\n"
+    
+    "💰 <b>Completed Purchases</b>\n"
+    "   • Last hour: {hr_purchase} (${hr_revenue:.0f})\n"
+    "   • Today: {td_purchase} (${td_revenue:.0f})\n\n"
+    
+    "❌ <b>Abandoned Checkouts</b>\n"
+    "   • Last hour: {hr_expired}\n"
+    "   • Today: {td_expired}\n\n"
+    
+    "📈 <b>Conversion Rate (Today)</b>\n"
+    "   • Scan → Click: {scan_to_click}\n"
+    "   • Click → Purchase: {click_to_purchase}"
+)
 
 
 def send_hourly_report():
     """Send the hourly analytics report to Telegram."""
     stats = get_stats(hours=1)
-    qr_stats = get_qr_scan_count()  # Fetch from QR Code Generator API
-    now = datetime.now(TIMEZONE)
+    # Reports run hourly, long past the cache TTL, so never report stale counts
+    qr_stats = get_qr_scan_count(allow_stale=False)  # Fetch from QR Code Generator API
     
-    # Calculate conversion rates
+    # Calculate conversion rates (integer percent, rounded half up)
     def calc_rate(numerator, denominator):
         if denominator == 0:
             return "—"
-        return f"{(numerator / denominator * 100):.0f}%"
+        return f"{(numerator * 100 + denominator // 2) // denominator}%"
     
     hour = stats['hour']
     today = stats['today']
@@ -481,37 +936,25 @@ def send_hourly_report():
     # Use QR API scans for conversion calculation if available
     qr_today = qr_stats['today'] if qr_stats['today'] > 0 else today['qr_scan']
     
-    scan_to_click = calc_rate(today['click'], qr_today)
-    click_to_purchase = calc_rate(today['purchase'], today['click'])
-    
-    message = (
-        f"📊 <b>Delivery Hatch — Hourly Report</b>\n"
-        f"━━━━━━━━━━━━━━━━━━━━━━━━━━━\n\n"
-        
-        f"🔲 <b>QR Code Scans</b>\n"
-        f"   • Last hour: {qr_stats['last_hour']}\n"
-        f"   • Today: {qr_stats['today']}\n"
-        f"   • All-time: {qr_stats['total']} ({qr_stats['unique']} unique)\n\n"
-        
-        f"🖱️ <b>Pre-order Clicks</b>\n"
-        f"   • Last hour: {hour['click']}\n"
-        f"   • Today: {today['click']}\n\n"
-        
-        f"💰 <b>Completed Purchases</b>\n"
-        f"   • Last hour: {hour['purchase']} (${hour['revenue']:.0f})\n"
-        f"   • Today: {today['purchase']} (${today['revenue']:.0f})\n\n"
-        
-        f"❌ <b>Abandoned Checkouts</b>\n"
-        f"   • Last hour: {hour['expired']}\n"
-        f"   • Today: {today['expired']}\n\n"
-        
-        f"📈 <b>Conversion Rate (Today)</b>\n"
-        f"   • Scan → Click: {scan_to_click}\n"
-        f"   • Click → Purchase: {click_to_purchase}"
-    )
+    message = HOURLY_REPORT_TEMPLATE.format_map({
+        'qr_last_hour': qr_stats['last_hour'],
+        'qr_today': qr_stats['today'],
+        'qr_total': qr_stats['total'],
+        'qr_unique': qr_stats['unique'],
+        'hr_click': hour['click'],
+        'td_click': today['click'],
+        'hr_purchase': hour['purchase'],
+        'td_purchase': today['purchase'],
+        'hr_revenue': hour['revenue'],
+        'td_revenue': today['revenue'],
+        'hr_expired': hour['expired'],
+        'td_expired': today['expired'],
+        'scan_to_click': calc_rate(today['click'], qr_today),
+        'click_to_purchase': calc_rate(today['purchase'], today['click'])
+    })
     
     send_telegram_message(message)
-    print(f"[{now}] Sent hourly report")
+    log.info("Sent hourly report")
 
 
 # ============================================================================
@@ -521,26 +964,52 @@ def send_hourly_report():
 @app.route('/debug/stats', methods=['GET'])
 def debug_stats():
     """Get current stats (for debugging)."""
-    return jsonify(get_stats(hours=24))
+    return json_response(get_stats(hours=24))
 
 
 @app.route('/debug/send-report', methods=['POST'])
 def debug_send_report():
     """Manually trigger the hourly report."""
     send_hourly_report()
-    return jsonify({'status': 'sent'})
+    return json_response({'status': 'sent'})
 
 
 @app.route('/emails', methods=['GET'])
 def list_emails():
-    """List all email signups (for exporting)."""
+    """
+    List email signups, newest first (for exporting).
+    
+    Paginated by signup id: pass the returned `next_before` as `?before=`
+    to get the next page. `?limit=` sets the page size (default 500).
+    `count` is the total number of signups, `page_count` the rows returned.
+    """
+    limit = min(max(request.args.get('limit', EMAILS_PAGE_SIZE, type=int), 1), EMAILS_MAX_PAGE_SIZE)
+    before = request.args.get('before', type=int)
+    
     with get_db() as conn:
-        rows = conn.execute(
-            'SELECT email, timestamp, source FROM email_signups ORDER BY timestamp DESC'
-        ).fetchall()
+        total = conn.execute(SQL_COUNT_SIGNUPS).fetchone()[0]
+        if before is None:
+            rows = conn.execute(
+                'SELECT id, email, timestamp, source FROM email_signups '
+                'ORDER BY id DESC LIMIT ?', (limit,)
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                'SELECT id, email, timestamp, source FROM email_signups '
+                'WHERE id < ? ORDER BY id DESC LIMIT ?', (before, limit)
+            ).fetchall()
     
-    emails = [{'email': r['email'], 'timestamp': r['timestamp'], 'source': r['source']} for r in rows]
-    return jsonify({'count': len(emails), 'emails': emails})
+    emails = [
+        {'email': email, 'timestamp': timestamp, 'source': source}
+        for _, email, timestamp, source in rows
+    ]
+    next_before = rows[-1][0] if len(rows) == limit else None
+    return json_response({
+        'count': total,
+        'page_count': len(emails),
+        'emails': emails,
+        'next_before': next_before,
+    })
 
 
 # ============================================================================
@@ -551,7 +1020,30 @@ scheduler = BackgroundScheduler(timezone=TIMEZONE)
 
 
 def start_scheduler():
-    """Start the APScheduler for hourly reports."""
+    """Start the APScheduler for event flushing, archiving and hourly reports."""
+    if scheduler.running:
+        return
+
+    scheduler.add_job(
+        _flush_events,
+        IntervalTrigger(seconds=EVENT_FLUSH_INTERVAL_SECONDS),
+        id='flush_events',
+        replace_existing=True,
+        coalesce=True
+    )
+    scheduler.add_job(
+        _archive_events,
+        CronTrigger(hour=3, minute=0),  # Nightly, off-peak
+        id='archive_events',
+        replace_existing=True
+    )
+    scheduler.add_job(
+        _prune_qr_snapshots,
+        CronTrigger(hour=3, minute=0),
+        id='prune_qr_snapshots',
+        replace_existing=True
+    )
+
     # DISABLED: Hourly reports turned off per user request
     # scheduler.add_job(
     #     send_hourly_report,
@@ -559,24 +1051,20 @@ def start_scheduler():
     #     id='hourly_report',
     #     replace_existing=True
     # )
-    # scheduler.start()
-    print(f"Scheduler disabled - hourly reports turned off.")
+    scheduler.start()
+    log.info("Scheduler started - hourly reports turned off.")
 
 
 # ============================================================================
 # Application Startup
 # ============================================================================
 
-# Initialize database on import
+# Initialize database on import (once, in the gunicorn master when preloaded)
 init_db()
 
-# Start scheduler when running directly or via gunicorn
-if os.environ.get('WERKZEUG_RUN_MAIN') == 'true' or 'gunicorn' in os.environ.get('SERVER_SOFTWARE', ''):
-    start_scheduler()
-elif __name__ != '__main__':
-    # Running under gunicorn
-    start_scheduler()
-
+# Under gunicorn the scheduler is started per worker by the post_fork hook in
+# gunicorn.conf.py, since its thread wouldn't survive the fork
 if __name__ == '__main__':
+    from waitress import serve
     start_scheduler()
-    app.run(debug=True, port=5000)
+    serve(app, host='0.0.0.0', port=int(os.getenv('PORT', '5000')), threads=8)